@@ -1,253 +1,298 @@
 from fastapi import FastAPI, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-import psycopg2
+from fastapi.responses import ORJSONResponse
+import asyncpg
+import redis.asyncio as redis
+import orjson
+import functools
+import hashlib
 from dotenv import load_dotenv
 import os
 from typing import List, Optional
 
 load_dotenv()
 
-app = FastAPI()
+# orjson encodes the big list responses several times faster than the
+# stdlib encoder FastAPI defaults to
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# How long cached query results stay valid; the upload script clears
+# the cache whenever new data lands, so this is just a safety net
+CACHE_TTL = 3600
+
+# Columns the aggregate endpoint is allowed to group by
+ALLOWED_GROUP_BY = frozenset({'artist_name', 'track_name', 'album_name',
+                              'year', 'month', 'day_of_week', 'hour'})
+
+# The UI issues the same handful of query shapes over and over, so
+# compose the SQL once per shape and reuse it
+@functools.lru_cache(maxsize=128)
+def _build_agg_query(group_by_columns, has_artist_filter, has_year_filter, top_per_group):
+    select_columns = ", ".join(group_by_columns)
+    group_by_clause = ", ".join(group_by_columns)
+
+    where_clauses = []
+    param_count = 0
+
+    if has_artist_filter:
+        param_count += 1
+        where_clauses.append(f"artist_name = ANY(${param_count})")
+
+    if has_year_filter:
+        param_count += 1
+        where_clauses.append(f"year = ANY(${param_count})")
+
+    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
+    limit_placeholder = f"${param_count + 1}"
+
+    if top_per_group and len(group_by_columns) > 1:
+        # Use window function to get top result per group
+        # Assuming the first column is the primary grouping
+        primary_group = group_by_columns[0]
+
+        return f"""
+            WITH ranked AS (
+                SELECT {select_columns},
+                       SUM(minutes) as total_minutes,
+                       SUM(plays)::bigint as play_count,
+                       ROW_NUMBER() OVER (PARTITION BY {primary_group} ORDER BY SUM(minutes) DESC) as rn
+                FROM mv_artist_daily
+                WHERE {where_sql}
+                GROUP BY {group_by_clause}
+            )
+            SELECT {select_columns}, total_minutes, play_count
+            FROM ranked
+            WHERE rn = 1
+            ORDER BY total_minutes DESC
+            LIMIT {limit_placeholder}
+        """
+
+    return f"""
+        SELECT {select_columns},
+               SUM(minutes) as total_minutes,
+               SUM(plays)::bigint as play_count
+        FROM mv_artist_daily
+        WHERE {where_sql}
+        GROUP BY {group_by_clause}
+        ORDER BY total_minutes DESC
+        LIMIT {limit_placeholder}
+    """
+
+# Add CORS middleware with environment-specific origins; a concrete
+# origin list (never "*") lets the middleware answer preflights from
+# precomputed headers, and max_age keeps them cached in the browser
+allowed_origins = [origin.strip() for origin in
+                   os.getenv('ALLOWED_ORIGIN', 'http://localhost:3000').split(',')]
 
-# Add CORS middleware with environment-specific origins
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[os.getenv('ALLOWED_ORIGIN')],
+    allow_origins=allowed_origins,
     allow_credentials=True,
     allow_methods=["GET"],
     allow_headers=["Content-Type"],
     max_age=3600,
 )
 
-# Database connection function
-def get_db_connection():
-    conn = psycopg2.connect(
+# Create the connection pool once at startup so requests don't pay
+# a TCP/auth handshake per call
+@app.on_event("startup")
+async def startup():
+    app.state.pool = await asyncpg.create_pool(
         host=os.getenv('DB_HOST'),
         port=int(os.getenv('DB_PORT')),
         database=os.getenv('DB_NAME'),
         user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD')
+        password=os.getenv('DB_PASSWORD'),
+        min_size=5,
+        max_size=20,
+        # keep idle connections warm instead of letting the pool
+        # tear them down between bursts of traffic
+        max_inactive_connection_lifetime=300,
+        # asyncpg prepares statements automatically; size the cache to
+        # hold every aggregate shape so Postgres plans each one once
+        # per connection
+        statement_cache_size=1024,
     )
-    return conn
-
-# Artists endpoint - all artists alphabetically
-@app.get("/api/artists")
-def get_artists():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT DISTINCT artist_name FROM spotify_streams ORDER BY artist_name")
-    
-    results = cur.fetchall()
-    
-    cur.close()
-    conn.close()
-    
-    return {"Data": [row[0] for row in results]}
+    app.state.redis = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+
+    # The schema only changes between deployments, so look the column
+    # list up once here instead of hitting information_schema per request
+    async with app.state.pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'spotify_streams'
+            AND column_name NOT IN ('id', 'created_at', 'date', 'ms_played', 'minutes_played')
+            ORDER BY column_name
+        """)
+    app.state.columns = [row[0] for row in rows]
+
+@app.on_event("shutdown")
+async def shutdown():
+    await app.state.redis.aclose()
+    await app.state.pool.close()
+
+# Cache helper - serve from Redis when possible, otherwise run the
+# query and cache its result
+async def fetch_cached(key, run_query):
+    cached = await app.state.redis.get(key)
+    if cached is not None:
+        return orjson.loads(cached)
+
+    result = await run_query()
+    await app.state.redis.setex(key, CACHE_TTL, orjson.dumps(result))
+    return result
+
+# Stream large single-column results through a server-side cursor so
+# the full Record list and the value list never sit in memory together
+async def fetch_column(query):
+    async with app.state.pool.acquire() as conn:
+        async with conn.transaction():
+            return [row[0] async for row in conn.cursor(query, prefetch=10_000)]
+
+# The dropdown list endpoints are the same DISTINCT query with a
+# different column, so register them all from one table
+DISTINCT_ENDPOINTS = {
+    'artists': 'artist_name',
+    'years': 'year',
+    'tracks': 'track_name',
+    'albums': 'album_name',
+}
+
+def _register_distinct_endpoint(name, column):
+    # column comes from the literal table above, never from user input
+    query = f"SELECT DISTINCT {column} FROM spotify_streams ORDER BY {column}"
+
+    async def endpoint():
+        async def run():
+            return {"Data": await fetch_column(query)}
+
+        return await fetch_cached(f"cache:{name}", run)
+
+    endpoint.__name__ = f"get_{name}"
+    app.get(f"/api/{name}")(endpoint)
+
+for _name, _column in DISTINCT_ENDPOINTS.items():
+    _register_distinct_endpoint(_name, _column)
 
 # Top artists by listening time (with optional date filtering)
 @app.get("/api/artists/top")
-def get_top_artists(
+async def get_top_artists(
     limit: int = Query(20, ge=1, le=100),
     start_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
     end_date: Optional[str] = Query(None, description="End date (YYYY-MM-DD)")
 ):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     where_clauses = []
     params = []
-    
+
     if start_date:
-        where_clauses.append("date >= %s")
         params.append(start_date)
-    
+        where_clauses.append(f"date >= ${len(params)}::date")
+
     if end_date:
-        where_clauses.append("date <= %s")
         params.append(end_date)
-    
+        where_clauses.append(f"date <= ${len(params)}::date")
+
     where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
-    
+
+    params.append(limit)
+
     query = f"""
-        SELECT artist_name, SUM(minutes_played) as total_minutes
-        FROM spotify_streams
+        SELECT artist_name, SUM(minutes) as total_minutes
+        FROM mv_artist_daily
         WHERE {where_sql}
         GROUP BY artist_name
         ORDER BY total_minutes DESC
-        LIMIT %s
+        LIMIT ${len(params)}
     """
-    
-    params.append(limit)
-    
-    cur.execute(query, params)
-    results = cur.fetchall()
-    
-    cur.close()
-    conn.close()
-    
-    return {"Data": [row[0] for row in results]}
-
-# Year endpoint
-@app.get("/api/years")
-def get_years():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT DISTINCT year FROM spotify_streams ORDER BY year")
-    
-    results = cur.fetchall()
-    
-    cur.close()
-    conn.close()
-    
-    return {"Data": [row[0] for row in results]}
-    
-# Column Endpoint 
+
+    async with app.state.pool.acquire() as conn:
+        rows = await conn.fetch(query, *params)
+
+    return {"Data": [row[0] for row in rows]}
+
+# Column Endpoint
 @app.get("/api/columns")
-def get_columns():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT column_name 
-        FROM information_schema.columns 
-        WHERE table_name = 'spotify_streams'
-        AND column_name NOT IN ('id', 'created_at', 'date', 'ms_played', 'minutes_played')
-        ORDER BY column_name
-    """)
-    
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    return {"Data": [row[0] for row in results]}
-    
-# Track endpoint
-@app.get("/api/tracks")
-def get_tracks():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT DISTINCT track_name FROM spotify_streams ORDER BY track_name")
-    
-    results = cur.fetchall()
-    
-    cur.close()
-    conn.close()
-    
-    return {"Data": [row[0] for row in results]}
-    
-# Album endpoint
-@app.get("/api/albums")
-def get_albums():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT DISTINCT album_name FROM spotify_streams ORDER BY album_name")
-    
-    results = cur.fetchall()
-    
-    cur.close()
-    conn.close()
-    
-    return {"Data": [row[0] for row in results]}
+async def get_columns():
+    return {"Data": app.state.columns}
+
+# Combined filter endpoint - the dashboard needs all four dropdown
+# lists at once, so produce them from a single scan instead of four
+@app.get("/api/filters")
+async def get_filters():
+    async def query():
+        async with app.state.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT kind, array_agg(DISTINCT val ORDER BY val) as vals
+                FROM (
+                    SELECT 'artists' AS kind, artist_name AS val FROM spotify_streams
+                    UNION ALL
+                    SELECT 'tracks', track_name FROM spotify_streams
+                    UNION ALL
+                    SELECT 'albums', album_name FROM spotify_streams
+                    UNION ALL
+                    SELECT 'years', year::text FROM spotify_streams
+                ) lists
+                GROUP BY kind
+            """)
+        lists = {row['kind']: row['vals'] for row in rows}
+        return {
+            "artists": lists.get('artists', []),
+            "tracks": lists.get('tracks', []),
+            "albums": lists.get('albums', []),
+            "years": [int(y) for y in lists.get('years', [])],
+        }
+
+    return await fetch_cached("cache:filters", query)
 
 
 @app.get("/api/aggregate")
-def aggregate_data(
+async def aggregate_data(
     group_by: str = Query(..., description="Comma-separated columns to group by"),
     filter_artists: Optional[str] = Query(None, description="Comma-separated artist names"),
     filter_years: Optional[str] = Query(None, description="Comma-separated years"),
     limit: int = Query(50, ge=1, le=1000),
     top_per_group: bool = Query(False, description="Return only top result per group")
 ):
-    # Parse the comma-separated string
-    group_by_columns = [col.strip() for col in group_by.split(',')]
-    
+    # Parse the comma-separated string (a tuple so the query cache can
+    # key on it)
+    group_by_columns = tuple(col.strip() for col in group_by.split(','))
+
     # Whitelist each column
-    ALLOWED_GROUP_BY = ['artist_name', 'track_name', 'album_name', 
-                        'year', 'month', 'day_of_week', 'hour']
-    
     for col in group_by_columns:
         if col not in ALLOWED_GROUP_BY:
             raise HTTPException(status_code=400, detail=f"Invalid column: {col}")
-    
-    # Build the SELECT and GROUP BY parts
-    select_columns = ", ".join(group_by_columns)
-    group_by_clause = ", ".join(group_by_columns)
-    
-    # Build WHERE clause
-    where_clauses = []
+
+    # Bind the filter parameters; the SQL shape only depends on which
+    # filters are present
     params = []
-    
-    # Handle multiple artists filter
+
     if filter_artists:
-        artist_list = [a.strip() for a in filter_artists.split(',')]
-        placeholders = ', '.join(['%s'] * len(artist_list))
-        where_clauses.append(f"artist_name IN ({placeholders})")
-        params.extend(artist_list)
-    
-    # Handle multiple years filter
+        params.append([a.strip() for a in filter_artists.split(',')])
+
     if filter_years:
-        year_list = [int(y.strip()) for y in filter_years.split(',')]
-        placeholders = ', '.join(['%s'] * len(year_list))
-        where_clauses.append(f"year IN ({placeholders})")
-        params.extend(year_list)
-    
-    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
-    
-    # Build query with multiple columns
-    if top_per_group and len(group_by_columns) > 1:
-        # Use window function to get top result per group
-        # Assuming the first column is the primary grouping
-        primary_group = group_by_columns[0]
-        other_columns = group_by_columns[1:]
-        
-        query = f"""
-            WITH ranked AS (
-                SELECT {select_columns}, 
-                       SUM(minutes_played) as total_minutes,
-                       COUNT(*) as play_count,
-                       ROW_NUMBER() OVER (PARTITION BY {primary_group} ORDER BY SUM(minutes_played) DESC) as rn
-                FROM spotify_streams
-                WHERE {where_sql}
-                GROUP BY {group_by_clause}
-            )
-            SELECT {select_columns}, total_minutes, play_count
-            FROM ranked
-            WHERE rn = 1
-            ORDER BY total_minutes DESC
-            LIMIT %s
-        """
-    else:
-        query = f"""
-            SELECT {select_columns}, 
-                   SUM(minutes_played) as total_minutes,
-                   COUNT(*) as play_count
-            FROM spotify_streams
-            WHERE {where_sql}
-            GROUP BY {group_by_clause}
-            ORDER BY total_minutes DESC
-            LIMIT %s
-        """
-    
+        params.append([int(y.strip()) for y in filter_years.split(',')])
+
     params.append(limit)
-    
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(query, params)
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    # Build response dynamically based on number of group_by columns
-    data = []
-    for row in results:
-        item = {}
-        for i, col in enumerate(group_by_columns):
-            item[col] = row[i]
-        item['total_minutes'] = float(row[len(group_by_columns)])
-        item['play_count'] = row[len(group_by_columns) + 1]
-        data.append(item)
-    
-    return {"data": data}
+
+    query = _build_agg_query(group_by_columns, bool(filter_artists),
+                             bool(filter_years), top_per_group)
+
+    # Hash the full parameter tuple into the cache key so every
+    # distinct aggregation caches separately
+    key_material = repr((group_by, filter_artists, filter_years, limit, top_per_group))
+    cache_key = "cache:aggregate:" + hashlib.sha1(key_material.encode()).hexdigest()
+
+    async def run_aggregate():
+        async with app.state.pool.acquire() as conn:
+            results = await conn.fetch(query, *params)
+
+        # Build response dynamically based on number of group_by columns
+        n = len(group_by_columns)
+        keys = group_by_columns + ('total_minutes', 'play_count')
+        data = [dict(zip(keys, row[:n] + (float(row[n]), row[n + 1])))
+                for row in results]
+
+        return {"data": data}
+
+    return await fetch_cached(cache_key, run_aggregate)
@@ -1,10 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pandas as pd
 from dotenv import load_dotenv
 from pathlib import Path
+import itertools
 import os
 import glob
-import json
+import orjson
 
 """
 Simplified class to load and clean Spotify streaming history data.
@@ -18,24 +20,24 @@ def load_json_files(json_folder_path):
     Returns:
         list: Raw data from all JSON files
     """
-    raw_data = []
     json_files = list(glob.glob(os.path.join(json_folder_path, '*.json')))
-    
-    
+
     if not json_files:
         raise FileNotFoundError(f"No JSON files found in {json_folder_path}")
-    
+
     print(f"Found {len(json_files)} JSON file(s)")
-    
-    for file_path in json_files:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # Handle both single dict and list of dicts
-            if isinstance(data, list):
-                raw_data.extend(data)
-            else:
-                raw_data.append(data)
-    
+
+    def parse(file_path):
+        with open(file_path, 'rb') as f:
+            data = orjson.loads(f.read())
+        # Handle both single dict and list of dicts
+        return data if isinstance(data, list) else [data]
+
+    # Spotify splits the export into many files; parse them in parallel.
+    # Threads are enough because orjson releases the GIL during the parse
+    with ThreadPoolExecutor(max_workers=min(len(json_files), os.cpu_count() or 4)) as executor:
+        raw_data = list(itertools.chain.from_iterable(executor.map(parse, json_files)))
+
     print(f"Loaded {len(raw_data)} streaming records")
     return raw_data
     
@@ -48,11 +50,20 @@ def clean_and_organize(data):
     """
     # Convert to DataFrame
     df = pd.DataFrame(data)
-    
+
     print(f"Initial data shape: {df.shape}")
-    
-    # Convert timestamp to datetime
-    df['ts'] = pd.to_datetime(df['ts'])
+
+    # Shorten the Spotify export names up front so the rest of the
+    # pipeline works with the final column names
+    df.rename(columns={
+        'master_metadata_track_name': 'track_name',
+        'master_metadata_album_artist_name': 'artist_name',
+        'master_metadata_album_album_name': 'album_name',
+    }, inplace=True)
+
+    # Convert timestamp to datetime (explicit format + cache beats
+    # letting pandas guess the format per value)
+    df['ts'] = pd.to_datetime(df['ts'], utc=True, format='ISO8601', cache=True)
     
     # Extract useful time components
     df['date'] = df['ts'].dt.date
@@ -61,28 +72,25 @@ def clean_and_organize(data):
     df['day_of_week'] = df['ts'].dt.day_name()
     df['hour'] = df['ts'].dt.hour
     
-    # Convert ms_played to minutes
-    df['minutes_played'] = df['ms_played'] / 60000
-    
-    # Filter out tracks with 0 playtime (skipped immediately)
-    df['is_valid_listen'] = df['ms_played'] > 0
-    
-    # Create a clean track identifier
-    df['track_id'] = df['master_metadata_track_name'] + ' - ' + \
-                          df['master_metadata_album_artist_name']
-    
     # Handle missing values
-    df['master_metadata_track_name'] = df['master_metadata_track_name'].fillna('Unknown Track')
-    df['master_metadata_album_artist_name'] = df['master_metadata_album_artist_name'].fillna('Unknown Artist')
-    df['master_metadata_album_album_name'] = df['master_metadata_album_album_name'].fillna('Unknown Album')
-    
-    # Delete values from unwanted columns
-    index = df['episode_name'].isna()
-    df = df[index]
-    df = df.drop(columns=['platform', 'ip_addr', 'audiobook_title', 'audiobook_uri', 'audiobook_chapter_uri', 'audiobook_chapter_title', 'episode_name', 'episode_show_name', 'spotify_track_uri', 'spotify_episode_uri', 'offline_timestamp', 'offline'])
+    df['track_name'] = df['track_name'].fillna('Unknown Track')
+    df['artist_name'] = df['artist_name'].fillna('Unknown Artist')
+    df['album_name'] = df['album_name'].fillna('Unknown Album')
+    
+    # Keep only music rows (podcast rows carry an episode_name); compute
+    # the mask first, then drop the bulky unwanted columns in place so
+    # the row filter only copies the narrow frame we keep
+    music_rows = df['episode_name'].isna()
+    df.drop(columns=['platform', 'ip_addr', 'audiobook_title', 'audiobook_uri',
+                     'audiobook_chapter_uri', 'audiobook_chapter_title',
+                     'episode_name', 'episode_show_name', 'spotify_track_uri',
+                     'spotify_episode_uri', 'offline_timestamp', 'offline'],
+            inplace=True)
+    df = df.loc[music_rows]
     
     print(f"Cleaned data shape: {df.shape}")
-    print(f"Total listening time: {df['minutes_played'].sum():.2f} minutes ({df['minutes_played'].sum()/60:.2f} hours)")
+    total_minutes = df['ms_played'].sum() / 60000
+    print(f"Total listening time: {total_minutes:.2f} minutes ({total_minutes/60:.2f} hours)")
     return df
     
 def write_to_json(df):
@@ -4,13 +4,14 @@ Script to upload Spotify streaming history from JSON to PostgreSQL database
 Updated to match the actual JSON structure with processed columns from cleaning .py
 """
 
-import json
+import io
 import psycopg2
-from psycopg2.extras import execute_batch
-from datetime import datetime
+import redis
 import os
 from dotenv import load_dotenv
 
+from clean_data import load_json_files, clean_and_organize
+
 
 # Load environment variables from .env file
 load_dotenv()
@@ -24,119 +25,127 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD')
 }
 
-# Path to JSON file
-JSON_FILE_PATH = os.getenv('CLEAN_JSON_DATA')
-
 def create_table(conn):
     """Create the spotify_streams table matching the JSON structure"""
     
-    # drop the old table if it exists
-    drop_table_query = "DROP TABLE IF EXISTS spotify_streams;"
+    # drop the old rollup view and table if they exist
+    drop_table_query = """
+    DROP MATERIALIZED VIEW IF EXISTS mv_artist_daily;
+    DROP TABLE IF EXISTS spotify_streams;
+    """
     
     # initialize insert table / indexes
     create_table_query = """
     CREATE TABLE spotify_streams (
         id SERIAL PRIMARY KEY,
         ms_played INTEGER,
-        conn_country VARCHAR(10),
-        track_name VARCHAR(500),
-        artist_name VARCHAR(500),
-        album_name VARCHAR(500),
-        reason_start VARCHAR(100),
-        reason_end VARCHAR(100),
+        conn_country TEXT,
+        track_name TEXT,
+        artist_name TEXT,
+        album_name TEXT,
+        reason_start TEXT,
+        reason_end TEXT,
         shuffle BOOLEAN,
         skipped BOOLEAN,
         incognito_mode BOOLEAN,
         date DATE,
         year INTEGER,
         month INTEGER,
-        day_of_week VARCHAR(20),
+        day_of_week TEXT,
         hour INTEGER,
-        minutes_played DECIMAL(10, 2),
-        is_valid_listen BOOLEAN,
-        track_id VARCHAR(255),
+        minutes_played DOUBLE PRECISION GENERATED ALWAYS AS (ms_played / 60000.0) STORED,
+        track_id TEXT GENERATED ALWAYS AS (track_name || ' - ' || artist_name) STORED,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
-    
-    CREATE INDEX idx_date ON spotify_streams(date);
-    CREATE INDEX idx_track_name ON spotify_streams(track_name);
-    CREATE INDEX idx_artist_name ON spotify_streams(artist_name);
-    CREATE INDEX idx_track_id ON spotify_streams(track_id);
-    CREATE INDEX idx_year_month ON spotify_streams(year, month);
+    """
+
+    # Precomputed rollup carrying every column the API can group by,
+    # so the aggregate endpoints never have to scan the raw rows.
+    # Populated by refresh_rollup() once the data is loaded.
+    create_rollup_query = """
+    CREATE MATERIALIZED VIEW mv_artist_daily AS
+    SELECT artist_name, track_name, album_name, date, year, month, day_of_week, hour,
+           SUM(minutes_played) AS minutes,
+           COUNT(*) AS plays
+    FROM spotify_streams
+    GROUP BY artist_name, track_name, album_name, date, year, month, day_of_week, hour
+    WITH NO DATA;
+
+    CREATE INDEX idx_mv_artist_date ON mv_artist_daily(artist_name, date);
     """
     # connect and add table / indexes
     with conn.cursor() as cur:
         cur.execute(drop_table_query)
         cur.execute(create_table_query)
+        cur.execute(create_rollup_query)
         conn.commit()
     print("✓ Table created/recreated")
 
-def parse_date(date_string):
-    """Parse date string to date object"""
-    if date_string:
-        try:
-            return datetime.strptime(date_string, '%Y-%m-%d').date()
-        except:
-            return None
-    return None
-
-def load_json_data(file_path):
-    """Load OG data from file"""
-    
-    print(f"Loading JSON from {file_path}...")
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    print(f"✓ Loaded {len(data)} records")
-    return data
-
-def insert_data(conn, data, batch_size=1000):
-    """Insert data into database in batches"""
-    insert_query = """
-    INSERT INTO spotify_streams (
-        ms_played, conn_country, track_name, artist_name, album_name,
-        reason_start, reason_end, shuffle, skipped, incognito_mode,
-        date, year, month, day_of_week, hour, minutes_played,
-        is_valid_listen, track_id
-    ) VALUES (
-        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-    )
+def create_indexes(conn):
+    """Create the indexes after the bulk load so COPY doesn't maintain
+    them row by row"""
+    create_indexes_query = """
+    CREATE INDEX idx_date ON spotify_streams(date);
+    CREATE INDEX idx_track_name ON spotify_streams(track_name);
+    CREATE INDEX idx_artist_name ON spotify_streams(artist_name);
+    CREATE INDEX idx_track_id ON spotify_streams(track_id);
+    CREATE INDEX idx_year_month ON spotify_streams(year, month);
+    CREATE INDEX idx_album_name ON spotify_streams(album_name);
+    CREATE INDEX idx_year ON spotify_streams(year);
+    CREATE INDEX idx_artist_minutes ON spotify_streams(artist_name) INCLUDE (minutes_played);
+    CREATE INDEX idx_group_cols ON spotify_streams(year, month, day_of_week, hour) INCLUDE (minutes_played);
     """
-    
     with conn.cursor() as cur:
-        batch = []
-        total = len(data)
-        
-        for i, record in enumerate(data):
-            values = (
-                record.get('ms_played'),
-                record.get('conn_country'),
-                record.get('master_metadata_track_name'),
-                record.get('master_metadata_album_artist_name'),
-                record.get('master_metadata_album_album_name'),
-                record.get('reason_start'),
-                record.get('reason_end'),
-                record.get('shuffle'),
-                record.get('skipped'),
-                record.get('incognito_mode'),
-                parse_date(record.get('date')),
-                record.get('year'),
-                record.get('month'),
-                record.get('day_of_week'),
-                record.get('hour'),
-                record.get('minutes_played'),
-                record.get('is_valid_listen'),
-                record.get('track_id')
-            )
-            batch.append(values)
-            
-            # Insert batch when it reaches batch_size or at the end
-            if len(batch) >= batch_size or i == total - 1:
-                execute_batch(cur, insert_query, batch)
-                conn.commit()
-                print(f"  Inserted {i + 1}/{total} records ({((i + 1) / total * 100):.1f}%)")
-                batch = []
-    
-    print("✓ All data inserted successfully")
+        cur.execute(create_indexes_query)
+        conn.commit()
+    print("✓ Indexes created")
+
+def refresh_rollup(conn):
+    """Rebuild the aggregate rollup view from the freshly loaded rows"""
+    with conn.cursor() as cur:
+        # refresh planner statistics first so the rollup query and the
+        # live endpoints pick the new indexes
+        cur.execute("ANALYZE spotify_streams;")
+        cur.execute("REFRESH MATERIALIZED VIEW mv_artist_daily;")
+        cur.execute("ANALYZE mv_artist_daily;")
+        conn.commit()
+    print("✓ Rollup view refreshed")
+    # invalidate after the refresh so the API cache can't repopulate
+    # from a stale rollup
+    invalidate_cache()
+
+# Columns loaded by COPY, in the order they are written to the CSV buffer
+COPY_COLUMNS = (
+    'ms_played', 'conn_country', 'track_name', 'artist_name', 'album_name',
+    'reason_start', 'reason_end', 'shuffle', 'skipped', 'incognito_mode',
+    'date', 'year', 'month', 'day_of_week', 'hour'
+)
+
+def insert_data(conn, df):
+    """Bulk-load the cleaned DataFrame with COPY"""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, columns=list(COPY_COLUMNS), na_rep='')
+
+    buffer.seek(0)
+    copy_query = f"COPY spotify_streams ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '')"
+
+    with conn.cursor() as cur:
+        cur.copy_expert(copy_query, buffer)
+        conn.commit()
+
+    print(f"✓ All {len(df):,} records inserted successfully")
+
+def invalidate_cache():
+    """Drop cached API responses so the endpoints serve the new data"""
+    try:
+        r = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        keys = r.keys('cache:*')
+        if keys:
+            r.delete(*keys)
+        r.close()
+        print(f"✓ Invalidated {len(keys)} cached API response(s)")
+    except redis.RedisError as e:
+        print(f"  Warning: could not invalidate API cache: {e}")
 
 def verify_data(conn):
     """Verify the uploaded data"""
@@ -179,30 +188,40 @@ def main():
     print("Spotify Data Upload to PostgreSQL")
     print("=" * 50)
     
-    # Check if JSON file exists
-    if not os.path.exists(JSON_FILE_PATH):
-        print(f"Error: JSON file not found at {JSON_FILE_PATH}")
-        print("Please update JSON_FILE_PATH in the script")
+    json_folder_path = os.getenv('INPUT_JSON_FOLDER')
+
+    # Check if the export folder exists
+    if not json_folder_path or not os.path.exists(json_folder_path):
+        print(f"Error: JSON folder not found at {json_folder_path}")
+        print("Please set INPUT_JSON_FOLDER in your .env file")
         return
-    
+
     try:
         # Connect to database
         print("\nConnecting to database...")
         conn = psycopg2.connect(**DB_CONFIG)
         print("✓ Connected to database")
-        
+
         # Create table
         print("\nCreating table...")
         create_table(conn)
-        
-        # Load JSON data
-        print("\nLoading JSON data...")
-        data = load_json_data(JSON_FILE_PATH)
-        
+
+        # Load and clean the raw export in-process - no JSON round-trip
+        print("\nLoading and cleaning JSON data...")
+        df = clean_and_organize(load_json_files(json_folder_path))
+
         # Insert data
         print("\nInserting data...")
-        insert_data(conn, data)
-        
+        insert_data(conn, df)
+
+        # Create indexes now that the data is in place
+        print("\nCreating indexes...")
+        create_indexes(conn)
+
+        # Refresh the rollup view
+        print("\nRefreshing rollup view...")
+        refresh_rollup(conn)
+
         # Verify data
         print("\nVerifying data...")
         verify_data(conn)
@@ -215,8 +234,6 @@ def main():
         
     except psycopg2.Error as e:
         print(f"\n Database error: {e}")
-    except json.JSONDecodeError as e:
-        print(f"\n JSON parsing error: {e}")
     except Exception as e:
         print(f"\n Unexpected error: {e}")
 